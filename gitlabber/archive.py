@@ -17,7 +17,4 @@ class ArchivedResults(enum.Enum):
 
     @staticmethod
     def argparse(s):
-        try:
-            return ArchivedResults[s.upper()]
-        except KeyError:
-            return s
+        return ArchivedResults.__members__.get(s.upper(), s)
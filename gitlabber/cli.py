@@ -2,23 +2,48 @@ import os
 import sys
 import logging
 import logging.handlers
-import enum
-from argparse import ArgumentParser, RawTextHelpFormatter, FileType, SUPPRESS
-from .gitlab_tree import GitlabTree
+import atexit
+import functools
+from queue import SimpleQueue
+from argparse import ArgumentParser, ArgumentTypeError, RawTextHelpFormatter, FileType, SUPPRESS
 from .format import PrintFormat
 from .method import CloneMethod
 from .naming import FolderNaming
 from .archive import ArchivedResults
 from . import __version__ as VERSION
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_FORMATTER = logging.Formatter(LOG_FORMAT)
+DEFAULT_CONCURRENCY = max(1, min(32, (os.cpu_count() or 1) * 2))
+# bounds the load a single run may put on the gitlab API
+MAX_API_CONCURRENCY = 20
+# the arguments defaulting to an environment variable, with the default used when it isn't set
+ENV_DEFAULTS = {
+    'token': ('GITLAB_TOKEN', None),
+    'url': ('GITLAB_URL', None),
+    'concurrency': ('GITLABBER_GIT_CONCURRENCY', DEFAULT_CONCURRENCY),
+    'api_concurrency': ('GITLABBER_API_CONCURRENCY', 5),
+    'naming': ('GITLABBER_FOLDER_NAMING', "name"),
+    'method': ('GITLABBER_CLONE_METHOD', "ssh"),
+    'include': ('GITLABBER_INCLUDE', ""),
+    'exclude': ('GITLABBER_EXCLUDE', ""),
+    'min_age': ('GITLABBER_MIN_AGE', None),
+    'cache_ttl': ('GITLABBER_CACHE_TTL', None),
+}
+
 log = logging.getLogger(__name__)
+# the (verbose, print) arguments the root logger was last configured for
+logging_state = None
+# writes the records queued by the worker threads to stdout when verbose
+log_listener = None
 
 def main():
-    args = parse_args(argv=None if sys.argv[1:] else ['--help'])
-    if args.version:
+    # answered before building the parser, packaging scripts call --version on its own
+    if sys.argv[1:] == ['--version']:
         print(VERSION)
-        sys.exit(0) 
+        sys.exit(0)
+
+    args = parse_args(argv=None if sys.argv[1:] else ['--help'])
 
     if args.token is None:
         print('Please specify a valid token with the -t flag or the \'GITLAB_TOKEN\' environment variable')
@@ -33,17 +58,20 @@ def main():
         sys.exit(1)
 
     config_logging(args)
-    includes=split(args.include)
-    excludes=split(args.exclude)
+    includes=parse_patterns(args.include)
+    excludes=parse_patterns(args.exclude)
 
-    args_print = vars(args).copy()
-    args_print['token'] = '__hidden__'
-    log.debug("running with args [%s]", args_print)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("running with args [%s]", {**vars(args), 'token': '__hidden__'})
 
+    # imported here as python-gitlab, anytree and GitPython are only needed once the arguments are valid
+    from .gitlab_tree import GitlabTree
     tree = GitlabTree(args.url, args.token, args.method, args.naming, args.archived.api_value, includes,
                       excludes, args.file, args.concurrency, args.recursive, args.verbose,
                       args.include_shared, args.use_fetch, args.hide_token, args.user_projects, 
-                      group_search=args.group_search, git_options=args.git_options)
+                      group_search=args.group_search, git_options=args.git_options, depth=args.depth,
+                      cache_ttl=args.cache_ttl, api_concurrency=args.api_concurrency, ssh_multiplex=args.ssh_multiplex,
+                      partial_clone=args.partial_clone, min_age=args.min_age)
     tree.load_tree()
 
     if tree.is_empty():
@@ -56,22 +84,62 @@ def main():
         tree.sync_tree(args.dest)
 
 
-def split(arg):
-    return arg.split(",") if arg != "" else None
+def parse_patterns(arg):
+    if "," not in arg:
+        pattern = arg.strip()
+        return (pattern,) if pattern else ()
+    return tuple(pattern for pattern in (item.strip() for item in arg.split(",")) if pattern)
 
 def config_logging(args):
+    global logging_state, log_listener
+    if args.git_trace:
+        os.environ.setdefault("GIT_PYTHON_TRACE", 'full')
+    if logging_state == (args.verbose, args.print):
+        return
+    logging_state = (args.verbose, args.print)
     if args.verbose:
         handler = logging.StreamHandler(sys.stdout)
-        logging.root.handlers = []
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-        logging.root.addHandler(handler)
+        handler.setFormatter(LOG_FORMATTER)
+        # the clone/pull threads only enqueue their records, a single listener thread writes them out
+        queue = SimpleQueue()
+        stop_log_listener()
+        log_listener = logging.handlers.QueueListener(queue, handler)
+        log_listener.start()
+        atexit.register(stop_log_listener)
+        logging.root.handlers = [logging.handlers.QueueHandler(queue)]
         level = logging.ERROR if args.print else logging.DEBUG
         logging.root.setLevel(level)
         log.debug("verbose=[%s], print=[%s], log level set to [%s] level", args.verbose, args.print, level)
-        os.environ["GIT_PYTHON_TRACE"] = 'full'
+    else:
+        # the queue logging of an earlier verbose call is replaced, otherwise the logging
+        # of an embedding application is left untouched when it already has handlers
+        replace_verbose = log_listener is not None
+        stop_log_listener()
+        logging.basicConfig(level=logging.INFO, format=LOG_FORMAT, force=replace_verbose)
+
+
+def stop_log_listener():
+    '''
+    flushes the queued log records and stops the listener thread
+    '''
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
 
 
 def parse_args(argv=None):
+    parser = build_parser()
+    # the parser is only built once, the environment is read again on every parse
+    parser.set_defaults(**{dest: os.environ.get(variable, default) for dest, (variable, default) in ENV_DEFAULTS.items()})
+    return parser.parse_args(argv)
+
+
+@functools.cache
+def build_parser():
+    '''
+    builds the argument parser once per process, the environment variable defaults are read at that time
+    '''
     example_text = r'''examples:
 
     clone an entire gitlab tree using a url and a token:
@@ -96,7 +164,25 @@ def parse_args(argv=None):
     gitlabber -U .
     
     perform a shallow clone of the git repositories
-    gitlabber -o "\-\-depth=1," .
+    gitlabber --depth 1 .
+
+    clone/pull 8 projects at a time using shallow clones
+    gitlabber -c 8 --depth 1 .
+
+    clone the projects without their file contents, fetching blobs when they are needed (e.g., on checkout)
+    gitlabber --partial-clone blob:none .
+
+    reuse the tree loaded from gitlab for an hour when pulling repeatedly
+    gitlabber --cache-ttl 3600 .
+
+    only pull the projects that weren't pulled in the last 5 minutes (e.g., when resuming an interrupted sync)
+    gitlabber --min-age 300 .
+
+    share one ssh connection per host between the clones of a large tree
+    gitlabber --ssh-multiplex .
+
+    provide additional options to the git command
+    gitlabber -o "\-\-single-branch," .
     '''
 
     parser = ArgumentParser(
@@ -113,7 +199,6 @@ def parse_args(argv=None):
         '-t',
         '--token',
         metavar=('token'),
-        default=os.environ.get('GITLAB_TOKEN'),
         help='gitlab personal access token https://docs.gitlab.com/ee/user/profile/personal_access_tokens.html')
     parser.add_argument(
         '-T',
@@ -125,12 +210,15 @@ def parse_args(argv=None):
         '-u',
         '--url',
         metavar=('url'),
-        default=os.environ.get('GITLAB_URL'),
         help='base gitlab url (e.g.: \'http://gitlab.mycompany.com\')')
     parser.add_argument(
         '--verbose',
         action='store_true',
         help='print more verbose output')
+    parser.add_argument(
+        '--git-trace',
+        action='store_true',
+        help='log every git command with its full output (very verbose, slows down large syncs)')
     parser.add_argument(
         '-f',
         '--file',
@@ -139,10 +227,14 @@ def parse_args(argv=None):
     parser.add_argument(
         '-c',
         '--concurrency',
-        default=os.environ.get('GITLABBER_GIT_CONCURRENCY', 1),
-        type=int,
+        type=validate_positive_int,
         metavar=('concurrency'),
-        help=SUPPRESS)
+        help='number of projects to clone/pull concurrently (default: twice the number of cpus, at most 32)')
+    parser.add_argument(
+        '--api-concurrency',
+        type=validate_api_concurrency,
+        metavar=('concurrency'),
+        help='number of concurrent gitlab API requests while loading the tree, at most %d (default: 5)' % MAX_API_CONCURRENCY)
     parser.add_argument(
         '-p',
         '--print',
@@ -159,14 +251,12 @@ def parse_args(argv=None):
         '--naming',
         type=FolderNaming.argparse,
         choices=list(FolderNaming),
-        default=FolderNaming.argparse(os.environ.get('GITLABBER_FOLDER_NAMING', "name")),
         help='the folder naming strategy for projects from the gitlab API attributes (default: "name")')
     parser.add_argument(
         '-m',
         '--method',
         type=CloneMethod.argparse,
         choices=list(CloneMethod),
-        default=os.environ.get('GITLABBER_CLONE_METHOD', "ssh"),
         help='the git transport method to use for cloning (default: "ssh")')
     parser.add_argument(
         '-a',
@@ -179,13 +269,11 @@ def parse_args(argv=None):
         '-i',
         '--include',
         metavar=('csv'),
-        default=os.environ.get('GITLABBER_INCLUDE', ""),
         help='comma delimited list of glob patterns of paths to projects or groups to clone/pull')
     parser.add_argument(
         '-x',
         '--exclude',
         metavar=('csv'),
-        default=os.environ.get('GITLABBER_EXCLUDE', ""),
         help='comma delimited list of glob patterns of paths to projects or groups to exclude from clone/pull')
     parser.add_argument(
         '-r',
@@ -222,21 +310,55 @@ def parse_args(argv=None):
         action='store_true',
         default=False,
         help='fetch only user personal projects (skips the group tree altogether, group related parameters are ignored). Clones personal projects to \'{gitlab-username}-personal-projects\'')
+    parser.add_argument(
+        '--depth',
+        type=validate_positive_int,
+        metavar=('depth'),
+        help='perform a shallow clone/pull with the history truncated to the specified number of commits')
+    parser.add_argument(
+        '--partial-clone',
+        metavar=('filter'),
+        help='perform a partial clone fetching the objects excluded by the filter on demand (e.g., blob:none, tree:0, blob:limit=1m)')
+    parser.add_argument(
+        '--min-age',
+        type=validate_positive_int,
+        metavar=('seconds'),
+        help='skip pulling projects that were cloned or pulled/fetched less than the given number of seconds ago')
+    parser.add_argument(
+        '--ssh-multiplex',
+        action='store_true',
+        help='share one ssh connection per host between the clones/pulls instead of connecting for every project (requires OpenSSH 8.5 or newer as older versions keep the first git command waiting on the master connection, not supported on windows, ignored when GIT_SSH_COMMAND is set)')
+    parser.add_argument(
+        '--cache-ttl',
+        type=validate_positive_int,
+        metavar=('seconds'),
+        help='reuse the tree loaded from gitlab for the given number of seconds instead of querying the API again (cached under $XDG_CACHE_HOME/gitlabber, ~/.cache/gitlabber by default)')
     parser.add_argument(
         '-o',
         '--git-options',
-        nargs=1,
         metavar=('options'),
         help='provide additional options as csv for the git command (e.g., --depth=1). See: clone/multi_options https://gitpython.readthedocs.io/en/stable/reference.html#')
     parser.add_argument(
         '--version',
-        action='store_true',
+        action='version',
+        version=VERSION,
         help='print the version')
 
-    return parser.parse_args(argv)
+    return parser
+
+def validate_positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise ArgumentTypeError(f"{value} is not a positive integer")
+    return number
+
+def validate_api_concurrency(value):
+    number = validate_positive_int(value)
+    if number > MAX_API_CONCURRENCY:
+        raise ArgumentTypeError(f"{value} is more than the maximum of {MAX_API_CONCURRENCY} concurrent API requests")
+    return number
 
 def validate_path(value):
-    if value.endswith('/'):
-        return value[:-1]
-    return value
+    # keep the root directory when the path is only slashes
+    return value.rstrip('/') or value[:1]
 
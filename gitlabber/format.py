@@ -13,7 +13,4 @@ class PrintFormat(enum.IntEnum):
 
     @staticmethod
     def argparse(s):
-        try:
-            return PrintFormat[s.upper()]
-        except KeyError:
-            return s
+        return PrintFormat.__members__.get(s.upper(), s)
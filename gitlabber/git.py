@@ -1,78 +1,238 @@
 import logging
 import os
 import sys
-import subprocess
+import random
+import time
+import tempfile
+import contextlib
 import git
+from git.exc import GitCommandError
 from .progress import ProgressBar
 import concurrent.futures
+import functools
+import itertools
 
 log = logging.getLogger(__name__)
 
 progress = ProgressBar('* syncing projects')
 
+# retries of a clone/pull failing with one of the transient network errors below
+RETRIES = 2
+TRANSIENT_ERRORS = ('could not resolve host', 'connection timed out', 'connection reset', 'early eof',
+                    'the remote end hung up unexpectedly', 'rpc failed', 'returned error: 502',
+                    'returned error: 503', 'returned error: 504')
+
 
 class GitAction:
-    def __init__(self, node, path, recursive=False, use_fetch=False, hide_token=False, git_options=None):
+    __slots__ = ('node', 'path', 'recursive', 'use_fetch', 'hide_token', 'git_options', 'depth', 'partial_clone', 'min_age', 'env')
+
+    def __init__(self, node, path, recursive=False, use_fetch=False, hide_token=False, git_options=None, depth=None, partial_clone=None, min_age=None, env=None):
         self.node = node
         self.path = path
         self.recursive = recursive
         self.use_fetch = use_fetch
         self.hide_token = hide_token
         self.git_options = git_options
+        self.depth = depth
+        self.partial_clone = partial_clone
+        self.min_age = min_age
+        self.env = env
 
-def sync_tree(root, dest, concurrency=1, disable_progress=False, recursive=False, use_fetch=False, hide_token=False, git_options=None):
+def sync_tree(root, dest, concurrency=1, disable_progress=False, recursive=False, use_fetch=False, hide_token=False, git_options=None, depth=None, projects=None,
+              ssh_multiplex=False, partial_clone=None, min_age=None):
     if not disable_progress:
-        progress.init_progress(len(root.leaves))
-    actions = get_git_actions(root, dest, recursive, use_fetch, hide_token)
-    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
-        executor.map(clone_or_pull_project, actions)
-    
+        progress.init_progress(len(root.leaves) if projects is None else projects)
+    with ssh_multiplexing(ssh_multiplex) as ssh_env, concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # a credentials prompt would block its worker (and the progress bar) forever, fail the project instead.
+        # the environment is passed to each git command, the process environment is left untouched
+        env = {} if 'GIT_TERMINAL_PROMPT' in os.environ else {'GIT_TERMINAL_PROMPT': '0'}
+        env.update(ssh_env or {})
+        actions = get_git_actions(root, dest, recursive, use_fetch, hide_token, git_options, depth, partial_clone, min_age, env)
+        # only a couple of actions per worker are queued at a time, the rest are submitted as they complete
+        pending = {executor.submit(clone_or_pull_project, action): action for action in itertools.islice(actions, 2 * concurrency)}
+        try:
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    action = pending.pop(future)
+                    try:
+                        category = future.result()
+                    except Exception as error:
+                        # a failed project doesn't stop the sync, only an interrupt does
+                        log.error("Error syncing project %s: %s", action.path, error, exc_info=log.isEnabledFor(logging.DEBUG))
+                        category = 'error'
+                    # the progress bar is only updated from this thread, the workers never wait on it
+                    if category is not None:
+                        progress.show_progress(action.node.name, category)
+                pending.update((executor.submit(clone_or_pull_project, action), action) for action in itertools.islice(actions, len(done)))
+        except BaseException:
+            # a user interrupt stops the sync, only the clones/pulls already running are waited for
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
     elapsed = progress.finish_progress()
     log.debug("Syncing projects took [%s]", elapsed)
 
 
-def get_git_actions(root, dest, recursive, use_fetch, hide_token):
-    actions = []
-    for child in root.children:
+@contextlib.contextmanager
+def ssh_multiplexing(enabled):
+    '''
+    yields the environment making the git commands of the sync share one ssh master connection per host
+    (through GIT_SSH_COMMAND), None when not multiplexing. the process environment is left untouched and
+    the masters exit shortly after the sync once their control sockets are removed
+    '''
+    if not enabled or os.name == 'nt' or 'GIT_SSH_COMMAND' in os.environ:
+        if enabled:
+            log.debug("Not multiplexing ssh connections (unsupported platform or GIT_SSH_COMMAND is set)")
+        yield None
+        return
+    # unix socket paths are limited to ~100 characters, %C (a hash of the connection) keeps the path short
+    with tempfile.TemporaryDirectory(prefix='gitlabber-ssh-', dir='/tmp' if os.path.isdir('/tmp') else None) as control_dir:
+        yield {'GIT_SSH_COMMAND': 'ssh -o ControlMaster=auto -o ControlPath=%s -o ControlPersist=10' % os.path.join(control_dir, '%C')}
+
+
+def get_git_actions(root, dest, recursive, use_fetch, hide_token, git_options=None, depth=None, partial_clone=None, min_age=None, env=None):
+    '''
+    walks the tree depth first with an explicit stack (in the same order as a recursive walk)
+    and yields an action for each leaf as it is reached, so clones start before the walk ends.
+    the walk doesn't touch the filesystem, the workers create the project directories
+    '''
+    stack = list(reversed(root.children))
+    while stack:
+        child = stack.pop()
         path = "%s%s" % (dest, child.root_path)
-        if not os.path.exists(path):
-            os.makedirs(path)
         if child.is_leaf:
-            actions.append(GitAction(child, path, recursive, use_fetch, hide_token))            
-        if not child.is_leaf:
-            actions.extend(get_git_actions(child, dest, recursive, use_fetch, hide_token))
-    return actions
+            yield GitAction(child, path, recursive, use_fetch, hide_token, git_options, depth, partial_clone, min_age, env)
+        else:
+            stack.extend(reversed(child.children))
 
 
-def is_git_repo(path):
+def create_project_dir(path):
+    '''
+    creates the project directory (makedirs creates the group directories above it),
+    returns True if it didn't exist yet
+    '''
     try:
-        _ = git.Repo(path).git_dir
+        os.makedirs(path)
         return True
-    except git.InvalidGitRepositoryError:
+    except FileExistsError:
         return False
 
 
+def fetched_within(path, seconds):
+    '''
+    returns True if the clone (or mirror) at the path was cloned or pulled/fetched in the last given seconds,
+    git touches FETCH_HEAD on every fetch so its mtime is the time of the last one. a clone that was never
+    fetched since has no FETCH_HEAD, the HEAD written by the clone gives its time instead
+    '''
+    for git_dir in (os.path.join(path, '.git'), path):
+        for name in ('FETCH_HEAD', 'HEAD'):
+            try:
+                return time.time() - os.stat(os.path.join(git_dir, name)).st_mtime < seconds
+            except OSError:
+                continue
+    return False
+
+
+def is_git_repo(path):
+    '''
+    returns True if the path holds a clone (a .git directory or file) or a mirror (a bare HEAD and objects),
+    checked with a stat instead of opening the repository with GitPython
+    '''
+    return os.path.exists(os.path.join(path, '.git')) or \
+        (os.path.isfile(os.path.join(path, 'HEAD')) and os.path.isdir(os.path.join(path, 'objects')))
+
+
+def open_repo(path):
+    '''
+    returns the git repository at the path, None if the project wasn't cloned yet
+    '''
+    try:
+        return git.Repo(path)
+    except (git.InvalidGitRepositoryError, git.NoSuchPathError):
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def get_clone_options(recursive, use_fetch, depth, git_options, partial_clone=None):
+    '''
+    returns the git clone options, every project of a sync shares the same settings
+    so they are only built (and the git options only split) once
+    '''
+    multi_options = []
+    if(recursive):
+        # the submodules are cloned in parallel as on pull, --jobs=0 lets git pick the number of jobs
+        multi_options += ['--recursive', '--jobs=0']
+    if(use_fetch):
+        multi_options.append('--mirror')
+    if(depth):
+        multi_options.append('--depth=%d' % depth)
+    if(partial_clone):
+        # git records the filter on the clone, later pulls/fetches apply it without being told
+        multi_options.append('--filter=%s' % partial_clone)
+    if(git_options):
+        multi_options += git_options.split(',')
+    return tuple(multi_options)
+
+
+def is_transient_error(error):
+    stderr = str(error.stderr).lower()
+    return any(message in stderr for message in TRANSIENT_ERRORS)
+
+
+def with_retries(operation, *args, **kwargs):
+    '''
+    runs the git operation, retrying it with an exponential backoff when it fails on a transient network error
+    '''
+    for attempt in range(RETRIES + 1):
+        try:
+            return operation(*args, **kwargs)
+        except GitCommandError as error:
+            if attempt == RETRIES or not is_transient_error(error):
+                raise
+            delay = 2 ** attempt + random.random()
+            log.debug("Retrying git %s in %.1f seconds after a transient error: %s", error.command, delay, error.stderr)
+            time.sleep(delay)
+
+
 def clone_or_pull_project(action):
-    if is_git_repo(action.path):
+    '''
+    clones or pulls the project, returns the operation ('clone', 'pull' or 'skip') for the progress bar
+    or None if there was nothing to sync
+    '''
+    # a directory that was just created can't hold a clone yet, only existing ones are probed
+    new = create_project_dir(action.path)
+    if not new and action.min_age and fetched_within(action.path, action.min_age):
+        log.debug("skipping project %s, fetched less than %d seconds ago", action.path, action.min_age)
+        return 'skip'
+    repo = open_repo(action.path) if not new and is_git_repo(action.path) else None
+    if repo is not None:
         '''
         Update existing project
         '''
         log.debug("updating existing project %s", action.path)
-        progress.show_progress(action.node.name, 'pull')
         
+        options = {}
+        if(action.depth):
+            options['depth'] = action.depth
+        if(action.env):
+            # the repository object belongs to this action, its git commands get the sync's environment
+            repo.git.update_environment(**action.env)
         try:
-            repo = git.Repo(action.path)
             if(not action.use_fetch):
-                repo.remotes.origin.pull()
+                with_retries(repo.remotes.origin.pull, **options)
             else:
-                repo.remotes.origin.fetch()
-            if(action.recursive): 
-                repo.submodule_update(recursive=True)
+                with_retries(repo.remotes.origin.fetch, **options)
+            if(action.recursive):
+                # git fetches the submodules in parallel, --jobs=0 lets it pick the number of jobs
+                repo.git.submodule('update', '--init', '--recursive', '--jobs=0')
         except KeyboardInterrupt:
             log.fatal("User interrupted")
             sys.exit(0)
-        except Exception as e:
-            log.error("Error pulling project %s", action.path, exc_info=True)
+        except Exception as error:
+            # the traceback is only formatted when it will be shown
+            log.error("Error pulling project %s: %s", action.path, error, exc_info=log.isEnabledFor(logging.DEBUG))
+        return 'pull'
     else:
         '''
         Clone new project
@@ -81,20 +241,15 @@ def clone_or_pull_project(action):
             log.debug("Skipping clone of node with type [%s] (empty subgroup/group)", action.node.type)
             return
         log.debug("cloning new project %s", action.path)
-        progress.show_progress(action.node.name, 'clone')
-        multi_options = []
-        if(action.recursive):
-            multi_options.append('--recursive')
-        if(action.use_fetch):
-            multi_options.append('--mirror')
-        if(action.git_options):
-            multi_options += action.git_options.split(',')
+        multi_options = get_clone_options(action.recursive, action.use_fetch, action.depth, action.git_options, action.partial_clone)
         try:
-            git.Repo.clone_from(action.node.url, action.path, multi_options=multi_options)
+            with_retries(git.Repo.clone_from, action.node.url, action.path, env=action.env, multi_options=list(multi_options))
                 
         except KeyboardInterrupt:
             log.fatal("User interrupted")
             sys.exit(0)
-        except Exception as e:
-            log.error("Error cloning project %s", action.path, exc_info=True)
+        except Exception as error:
+            # the traceback is only formatted when it will be shown
+            log.error("Error cloning project %s: %s", action.path, error, exc_info=log.isEnabledFor(logging.DEBUG))
+        return 'clone'
 
@@ -3,28 +3,40 @@ from gitlab.exceptions import GitlabGetError, GitlabListError
 from gitlab.exceptions import GitlabGetError
 from anytree import Node, RenderTree
 from anytree.exporter import DictExporter, JsonExporter
-from anytree.importer import DictImporter
-from .git import sync_tree
+from anytree.importer import DictImporter, JsonImporter
+from requests import Session
+from requests.adapters import HTTPAdapter, Retry
 from .format import PrintFormat
 from .method import CloneMethod
 from .naming import FolderNaming
 from .progress import ProgressBar
+import collections
+import concurrent.futures
+import hashlib
+import itertools
 import yaml
 import globre
 import logging
 import os
+import time
 log = logging.getLogger(__name__)
 
+PAGE_SIZE = 100
+
 
 class GitlabTree:
-    def __init__(self, url, token, method, naming=None, archived=None, includes=[], excludes=[], in_file=None, concurrency=1, recursive=False, disable_progress=False,
-                include_shared=True, use_fetch=False, hide_token=False, user_projects=False, group_search=None, git_options=None):
-        self.includes = includes
-        self.excludes = excludes
+    def __init__(self, url, token, method, naming=None, archived=None, includes=(), excludes=(), in_file=None, concurrency=1, recursive=False, disable_progress=False,
+                include_shared=True, use_fetch=False, hide_token=False, user_projects=False, group_search=None, git_options=None,
+                api_concurrency=5, depth=None, cache_ttl=None, ssh_multiplex=False, partial_clone=None, min_age=None):
+        self.includes = GitlabTree.compile_patterns(includes)
+        self.excludes = GitlabTree.compile_patterns(excludes)
         self.url = url
         self.root = Node("", root_path="", url=url, type="root")
         self.gitlab = Gitlab(url, private_token=token,
-                             ssl_verify=GitlabTree.get_ca_path())
+                             ssl_verify=GitlabTree.get_ca_path(),
+                             # one connection per API worker and per page worker, the group listing is
+                             # streamed before they start and reuses one of their connections
+                             session=GitlabTree.get_session(2 * api_concurrency))
         self.method = method
         self.naming = naming
         self.archived = archived
@@ -40,6 +52,16 @@ class GitlabTree:
         self.user_projects = user_projects
         self.group_search = group_search
         self.git_options = git_options
+        self.api_concurrency = api_concurrency
+        self.depth = depth
+        self.cache_ttl = cache_ttl
+        self.ssh_multiplex = ssh_multiplex
+        self.partial_clone = partial_clone
+        self.min_age = min_age
+        self.cache_file = self.get_cache_path() if cache_ttl else None
+        self.page_executor = None
+        # set when a listing error left groups or projects out of the loaded tree
+        self.incomplete = False
 
     @staticmethod
     def get_ca_path():
@@ -49,19 +71,49 @@ class GitlabTree:
         return next(item for item in [os.getenv('REQUESTS_CA_BUNDLE', None), os.getenv('CURL_CA_BUNDLE', None), True]
                     if item is not None)
 
+    @staticmethod
+    def get_session(pool_size):
+        """
+        returns a requests session able to keep a connection alive for each concurrent API call,
+        a kept alive connection closed by the server is retried instead of failing the listing
+        """
+        session = Session()
+        adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=Retry(total=3, backoff_factor=0.3))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def get_cache_path(self):
+        '''
+        returns the file caching the tree loaded with the current url, token and listing options,
+        include/exclude patterns are applied after loading so they are not part of the key
+        '''
+        key = "|".join(str(option) for option in [self.url, self.token, self.method, self.naming, self.archived,
+                                                  self.include_shared, self.hide_token, self.user_projects, self.group_search])
+        cache_dir = os.getenv('XDG_CACHE_HOME', os.path.expanduser(os.path.join('~', '.cache')))
+        return os.path.join(cache_dir, 'gitlabber', "tree-%s.json" % hashlib.sha256(key.encode()).hexdigest())
+
+    @staticmethod
+    def compile_patterns(patterns):
+        """
+        returns the glob patterns compiled once to regular expressions (empty if there are no patterns)
+        """
+        return tuple((pattern, globre.compile(pattern)) for pattern in patterns or ())
+
     def is_included(self, node):
         '''
         returns True if the node should be included.
         if there are no include patterns then everything is included
         any include patterns matching the root path will result in inclusion
         '''
-        if self.includes is not None:
-            for include in self.includes:
-                log.debug(f"Checking requested include: {include} with path: {node.root_path}, match {globre.match(include, node.root_path)}")
-                if globre.match(include, node.root_path):
-                    return True
-        else:
+        if not self.includes:
             return True
+        for include, regex in self.includes:
+            match = regex.match(node.root_path)
+            log.debug("Checking requested include: %s with path: %s, match %s", include, node.root_path, match)
+            if match:
+                return True
+        return False
 
     def is_excluded(self, node):
         '''
@@ -69,12 +121,11 @@ class GitlabTree:
         if the are no exclude patterns then nothing is excluded
         any exclude pattern matching the root path will result in exclusion
         '''
-        if self.excludes is not None:
-            for exclude in self.excludes:
-                log.debug(f"Checking requested exclude: {exclude} with path: {node.root_path}, match {globre.match(exclude, node.root_path)}")
-                if globre.match(exclude, node.root_path):
-                    return True
-        
+        for exclude, regex in self.excludes:
+            match = regex.match(node.root_path)
+            log.debug("Checking requested exclude: %s with path: %s, match %s", exclude, node.root_path, match)
+            if match:
+                return True
         return False
 
     def filter_tree(self, parent):
@@ -92,13 +143,8 @@ class GitlabTree:
                 if self.is_excluded(child):
                     child.parent = None
 
-    def root_path(self, node):
-        return "/".join([str(n.name) for n in node.path])
-
     def make_node(self, type, name, parent, url):
-        node = Node(name=name, parent=parent, url=url, type=type)
-        node.root_path = self.root_path(node)
-        return node
+        return Node(name=name, parent=parent, url=url, type=type, root_path=f"{parent.root_path}/{name}")
 
     def add_projects(self, parent, projects):
         for project in projects:
@@ -114,44 +160,102 @@ class GitlabTree:
                                   url=project_url)
             self.progress.show_progress(node.name, 'project')
 
-    def get_projects(self, group, parent):
+    def list_all_pages(self, manager, **kwargs):
+        '''
+        returns all the items of a paginated listing, once the first page reports
+        the number of pages the remaining pages are fetched concurrently
+        '''
+        listing = manager.list(iterator=True, per_page=PAGE_SIZE, **kwargs)
+        if not listing.total_pages:
+            # gitlab omits the page count on very large listings, follow the next page links instead
+            return list(listing)
+        items = list(itertools.islice(listing, PAGE_SIZE))
+        pages = self.page_executor.map(lambda page: manager.list(page=page, per_page=PAGE_SIZE, **kwargs),
+                                       range(2, listing.total_pages + 1))
+        for page in pages:
+            items.extend(page)
+        return items
+
+    def get_projects(self, group, name):
         try:
-            projects = group.projects.list(archived=self.archived, with_shared=self.include_shared, get_all=True)
-            self.progress.update_progress_length(len(projects))
-            self.add_projects(parent, projects)
+            return self.list_all_pages(group.projects, archived=self.archived, with_shared=self.include_shared)
         except GitlabListError as error:
-            log.error(f"Error getting projects on {group.name} id: [{group.id}]  error message: [{error.error_message}]")
-
-    def get_subgroups(self, group, parent):
-        subgroups = group.subgroups.list(as_list=False, get_all=True)
-        self.progress.update_progress_length(len(subgroups))
-        for subgroup_def in subgroups:
-            try:
-                subgroup = self.gitlab.groups.get(subgroup_def.id)
+            log.error("Error getting projects on %s id: [%s]  error message: [%s]", name, group.id, error.error_message)
+            self.incomplete = True
+            return []
+
+    def get_descendant_groups(self, group, name):
+        try:
+            return self.list_all_pages(group.descendant_groups)
+        except GitlabListError as error:
+            if error.response_code == 404:
+                log.error("%s error while listing subgroups of group with name: %s [id: %s]. Check your permissions as you may not have access to it. Message: %s",
+                          error.response_code, name, group.id, error.error_message)
+                self.incomplete = True
+                return []
+            raise error
+
+    def add_descendant_groups(self, group, node, descendants):
+        '''
+        adds the whole subgroup hierarchy of a top level group from its flat descendant groups listing,
+        linking each subgroup to its parent id. returns a lazy group with the node of the group
+        and of each subgroup to list their projects
+        '''
+        children = collections.defaultdict(list)
+        for descendant in descendants:
+            children[descendant.parent_id].append(descendant)
+        added = [(group, node)]
+        stack = [(group.id, node)]
+        while stack:
+            parent_id, parent = stack.pop()
+            for subgroup in children[parent_id]:
                 subgroup_id = subgroup.name if self.naming == FolderNaming.NAME else subgroup.path
-                node = self.make_node("subgroup", subgroup_id, parent, url=subgroup.web_url)
-                self.progress.show_progress(node.name, 'group')
-                self.get_subgroups(subgroup, node)
-                self.get_projects(subgroup, node)
-            except GitlabListError as error:
-                if error.response_code == 404:
-                    log.error(f"{error.response_code} error while listing subgroup with name: {group.name} [id: {group.id}]. Check your permissions as you may not have access to it. Message: {error.error_message}")
-                    continue
-                else:
-                    raise error
+                subgroup_node = self.make_node("subgroup", subgroup_id, parent, url=subgroup.web_url)
+                added.append((self.gitlab.groups.get(subgroup.id, lazy=True), subgroup_node))
+                stack.append((subgroup.id, subgroup_node))
+        # only the subgroups reached from the group are counted, a descendant whose parent
+        # isn't visible to the user can't be placed in the tree
+        self.progress.update_progress_length(len(added) - 1)
+        for _, subgroup_node in added[1:]:
+            self.progress.show_progress(subgroup_node.name, 'group')
+        return added
+
+    def load_groups(self, groups):
+        '''
+        loads the tree concurrently, the hierarchy under each top level group comes from a single descendant
+        groups listing and the projects of its groups are requested as soon as it is added, the projects are
+        still listed per group as shared projects belong to the group they are shared with rather than to
+        their namespace. the nodes are only created by the calling thread
+        '''
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.api_concurrency) as executor, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=self.api_concurrency) as self.page_executor:
+            # a top level group is pending on its descendant groups, any other entry on the projects of its node
+            pending = {executor.submit(self.get_descendant_groups, group, node.name): (group, node) for group, node in groups}
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    group, node = pending.pop(future)
+                    if group is not None:
+                        for listed_group, listed_node in self.add_descendant_groups(group, node, future.result()):
+                            pending[executor.submit(self.get_projects, listed_group, listed_node.name)] = (None, listed_node)
+                    else:
+                        projects = future.result()
+                        self.progress.update_progress_length(len(projects))
+                        self.add_projects(node, projects)
 
     def load_gitlab_tree(self):
         log.debug(f"Starting group search with archived: {self.archived} search term: {self.group_search}")
                     
-        groups = self.gitlab.groups.list(as_list=False, archived=self.archived, get_all=True, search=self.group_search)
+        groups = self.gitlab.groups.list(iterator=True, archived=self.archived, search=self.group_search)
         self.progress.init_progress(len(groups))
+        top_level = []
         for group in groups:
             if group.parent_id is None:
                 group_id = group.name if self.naming == FolderNaming.NAME else group.path
                 node = self.make_node("group", group_id, self.root, url=group.web_url)
                 self.progress.show_progress(node.name, 'group')
-                self.get_subgroups(group, node)
-                self.get_projects(group, node)        
+                top_level.append((group, node))
+        self.load_groups(top_level)
 
         elapsed = self.progress.finish_progress()
         log.debug("Loading projects tree from gitlab took [%s]", elapsed)
@@ -161,12 +265,44 @@ class GitlabTree:
             dct = yaml.safe_load(stream)
             self.root = DictImporter().import_(dct)
 
+    def is_cache_fresh(self):
+        return self.cache_file is not None and os.path.exists(self.cache_file) and \
+            time.time() - os.path.getmtime(self.cache_file) < self.cache_ttl
+
+    def load_cached_tree(self):
+        with open(self.cache_file, 'r') as stream:
+            self.root = JsonImporter().read(stream)
+
+    def save_cached_tree(self):
+        '''
+        writes the loaded tree to the cache file, the project urls may embed the token
+        so the file is only readable by the current user. a tree missing groups or projects
+        because of listing errors isn't cached so the next run lists them again
+        '''
+        if self.cache_file is None:
+            return
+        if self.incomplete:
+            log.debug("Not caching the tree as some groups or projects couldn't be listed")
+            return
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        temp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            with open(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as stream:
+                JsonExporter().write(self.root, stream)
+            os.replace(temp_file, self.cache_file)
+        finally:
+            # a failed or interrupted write doesn't leave its temp file in the cache directory
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        log.debug("Saved tree to cache [%s]", self.cache_file)
+
     def load_user_tree(self):
         log.debug(f"Starting user project search with archived: {self.archived}")
         self.gitlab.auth()
-        user = self.gitlab.users.get(self.gitlab.user.id)
-        username = user.username
-        projects = user.projects.list(as_list=False, archived=self.archived, get_all=True)
+        # the authenticated user already carries the username, a lazy user is enough to list its projects
+        username = self.gitlab.user.username
+        user = self.gitlab.users.get(self.gitlab.user.id, lazy=True)
+        projects = user.projects.list(iterator=True, archived=self.archived)
         self.progress.init_progress(len(projects))
         root = self.make_node("group", f"{username}-prsonal-projects", self.root, url=f"{self.url}/users/{username}/projects")
         self.add_projects(root, projects)
@@ -176,12 +312,17 @@ class GitlabTree:
         if self.in_file:
             log.debug("Loading tree from file [%s]", self.in_file)
             self.load_file_tree()
+        elif self.is_cache_fresh():
+            log.debug("Loading tree from cache [%s]", self.cache_file)
+            self.load_cached_tree()
         elif self.user_projects:
             log.debug("Loading user personal projects from gitlab server [%s]", self.url)
             self.load_user_tree()
+            self.save_cached_tree()
         else:
             log.debug("Loading projects tree from gitlab server [%s]", self.url)
             self.load_gitlab_tree()
+            self.save_cached_tree()
 
         log.debug("Fetched root node with [%d] projects" % len(
             self.root.leaves))
@@ -215,11 +356,17 @@ class GitlabTree:
         print(exporter.export(self.root))
 
     def sync_tree(self, dest):
-        log.debug("Going to clone/pull [%s] groups and [%s] projects" %
-                  (len(self.root.descendants) - len(self.root.leaves), len(self.root.leaves)))
+        # every count is a full walk of the tree, the projects are counted once and handed to the progress bar
+        projects = len(self.root.leaves)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Going to clone/pull [%s] groups and [%s] projects", len(self.root.descendants) - projects, projects)
+        # GitPython is only loaded when syncing, printing the tree doesn't need it
+        from .git import sync_tree
         sync_tree(self.root, dest, concurrency=self.concurrency,
                   disable_progress=self.disable_progress, recursive=self.recursive,
-                  use_fetch=self.use_fetch, hide_token=self.hide_token)
+                  use_fetch=self.use_fetch, hide_token=self.hide_token, git_options=self.git_options,
+                  depth=self.depth, projects=projects, ssh_multiplex=self.ssh_multiplex,
+                  partial_clone=self.partial_clone, min_age=self.min_age)
 
     def is_empty(self):
         return self.root.height < 1
@@ -13,7 +13,4 @@ class CloneMethod(enum.IntEnum):
 
     @staticmethod
     def argparse(s):
-        try:
-            return CloneMethod[s.upper()]
-        except KeyError:
-            return s
+        return CloneMethod.__members__.get(s.upper(), s)
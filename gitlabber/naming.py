@@ -12,7 +12,4 @@ class FolderNaming(enum.IntEnum):
 
     @staticmethod
     def argparse(s):
-        try:
-            return FolderNaming[s.upper()]
-        except KeyError:
-            return s
+        return FolderNaming.__members__.get(s.upper(), s)
@@ -1,10 +1,12 @@
         
 
 from tqdm import tqdm
+import threading
 import time
 class ProgressBar:
     def __init__(self, description='', disabled=False):
         self.progress = None
+        self.lock = threading.Lock()
         self.description = description
         self.disabled = disabled
         self.start = time.time()
@@ -16,14 +18,17 @@ class ProgressBar:
 
     def update_progress_length(self, added):
         if self.progress is not None:
-            self.progress.total = self.progress.total + added
-            self.progress.refresh()
+            with self.lock:
+                self.progress.total = self.progress.total + added
+                self.progress.refresh()
 
     def show_progress(self, text, category='~'):
         if self.progress is not None:
-            self.progress.update(1)
-            postfix = {category : text}
-            self.progress.set_postfix(postfix)
+            with self.lock:
+                # update() only redraws the bar every mininterval, set_postfix would force a redraw per project
+                postfix = {category : text}
+                self.progress.set_postfix(postfix, refresh=False)
+                self.progress.update(1)
 
     def finish_progress(self):
         if self.progress is not None:
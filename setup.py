@@ -68,7 +68,8 @@ setup(
             'pyyaml',
             'tqdm',
             'GitPython', 
-            'python-gitlab'
+            'python-gitlab',
+            'requests'
     ],
     install_requires = [
             'docopt', 
@@ -77,7 +78,8 @@ setup(
             'pyyaml',
             'tqdm',
             'GitPython', 
-            'python-gitlab'
+            'python-gitlab',
+            'requests'
     ],
     tests_require=  ['coverage', 'pytest', 'pytest-cov', 'pytest-integration'],
     entry_points = {
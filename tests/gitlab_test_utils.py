@@ -1,5 +1,6 @@
 import pytest
 import json
+import math
 from unittest import mock
 from gitlabber import gitlab_tree
 from gitlabber.method import CloneMethod
@@ -23,7 +24,7 @@ TREE_TEST_OUTPUT_FILE = "tests/test-output.tree"
 
 
 class MockNode:
-    def __init__(self, type, id, name, url, subgroups=mock.MagicMock(), projects=mock.MagicMock(), parent_id=None, archived=0, shared=False, group_search=None, git_options=None):
+    def __init__(self, type, id, name, url, subgroups=None, projects=None, parent_id=None, archived=0, shared=False, group_search=None, git_options=None):
         self.type = type
         self.id = id
         self.name = name
@@ -32,21 +33,37 @@ class MockNode:
         self.web_url = url
         self.ssh_url_to_repo = url
         self.http_url_to_repo = url
-        self.subgroups = subgroups
-        self.projects = projects
+        self.subgroups = subgroups if subgroups is not None else Listable()
+        self.projects = projects if projects is not None else Listable()
         self.parent_id = parent_id
+        descendants = []
+        for subgroup in self.subgroups.nodes:
+            subgroup.parent_id = id
+            descendants.append(subgroup)
+            descendants.extend(subgroup.descendant_groups.nodes)
+        self.descendant_groups = Listable(*descendants)
         self.archived = archived
         self.shared = shared
         self.group_search = group_search
 
 
+class Page(list):
+    def __init__(self, items, total_pages):
+        super().__init__(items)
+        self.total_pages = total_pages
+
+
 class Listable:
     def __init__(self, *nodes: MockNode):
         self.nodes = nodes
 
-    def list(self, as_list=False, archived=None, with_shared=True, get_all=True, search=None):
-        filtered = filter(lambda it: self.is_included(it, archived, with_shared), self.nodes)
-        return list(filtered)
+    def list(self, as_list=False, archived=None, with_shared=True, get_all=True, search=None, iterator=False, page=None, per_page=None):
+        filtered = list(filter(lambda it: self.is_included(it, archived, with_shared), self.nodes))
+        if page is not None:
+            return filtered[(page - 1) * per_page:page * per_page]
+        if per_page is not None:
+            return Page(filtered, max(1, math.ceil(len(filtered) / per_page)))
+        return filtered
 
     def is_included(self, node: MockNode, archived, shared):
         if node.shared and shared is False:
@@ -70,10 +87,10 @@ class Tree:
             self.all_nodes.extend(self.get_all_nodes(root_node))
         self.roots = roots
 
-    def get(self, id):
+    def get(self, id, lazy=False):
         return next(filter(lambda it: it.id == id, self.all_nodes))
 
-    def list(self, as_list=False, archived=None, with_shared=True, get_all=True, search=None):
+    def list(self, as_list=False, archived=None, with_shared=True, get_all=True, search=None, iterator=False):
         return self.roots.list(as_list, archived, with_shared)
 
     def get_all_nodes(self, node: MockNode):
@@ -119,9 +136,9 @@ def validate_tree(root):
     validate_subgroup(root.children[0].children[0])
     validate_project(root.children[0].children[0].children[0])
 
-def create_test_gitlab(monkeypatch, includes=None, excludes=None, in_file=None, hide_token=True, method=CloneMethod.SSH):
+def create_test_gitlab(monkeypatch, includes=None, excludes=None, in_file=None, hide_token=True, method=CloneMethod.SSH, cache_ttl=None):
     gl = gitlab_tree.GitlabTree(
-        URL, TOKEN, "ssh", "name", includes=includes, excludes=excludes, in_file=in_file, hide_token=hide_token)
+        URL, TOKEN, "ssh", "name", includes=includes, excludes=excludes, in_file=in_file, hide_token=hide_token, cache_ttl=cache_ttl)
     projects = Listable(MockNode("project", 2, PROJECT_NAME, PROJECT_URL if hide_token else PROJECT_URL_WITH_TOKEN))
     groups = Listable(
             MockNode("group", 2, GROUP_NAME, GROUP_URL, subgroups=Listable(
@@ -172,4 +189,28 @@ def create_test_gitlab_with_shared(monkeypatch, includes=None, excludes=None, in
     monkeypatch.setattr(gl.gitlab, "groups", Tree(Listable(
         MockNode("group", 21, GROUP_NAME, GROUP_URL, projects=projects)
     )))
-    return gl
\ No newline at end of file
+    return gl
+
+
+def create_test_gitlab_with_many_projects(monkeypatch, count):
+    gl = gitlab_tree.GitlabTree(URL, TOKEN, "ssh", "name")
+    projects = Listable(*[MockNode("project", 100 + i, f"{PROJECT_NAME}{i}", PROJECT_URL) for i in range(count)])
+    monkeypatch.setattr(gl.gitlab, "groups", Tree(Listable(
+        MockNode("group", 22, GROUP_NAME, GROUP_URL, projects=projects)
+    )))
+    return gl
+
+
+def create_test_gitlab_with_nested_subgroups(monkeypatch):
+    gl = gitlab_tree.GitlabTree(URL, TOKEN, "ssh", "name")
+    projects = Listable(MockNode("project", 30, PROJECT_NAME, PROJECT_URL))
+    monkeypatch.setattr(gl.gitlab, "groups", Tree(Listable(
+        MockNode("group", 31, GROUP_NAME, GROUP_URL, subgroups=Listable(
+            MockNode("subgroup", 32, SUBGROUP_NAME, SUBGROUP_URL, subgroups=Listable(
+                MockNode("subgroup", 33, "nested", SUBGROUP_URL + "/nested", projects=projects)
+            )),
+            MockNode("subgroup", 34, "sibling", SUBGROUP_URL + "/sibling")
+        ))
+    )))
+    return gl
+
@@ -8,8 +8,11 @@ from gitlabber.method import CloneMethod
 from gitlabber.naming import FolderNaming
 from gitlabber.archive import ArchivedResults
 from unittest import mock
+from argparse import ArgumentTypeError
 from anytree import Node
 import pytest
+import logging
+import logging.handlers
 
 
 def exit():
@@ -17,27 +20,31 @@ def exit():
     sys.exit()
 
 
-def test_args_version():
-    args_mock = mock.Mock()
-    args_mock.return_value = Node(type="test", name="test", version=True)
-    cli.parse_args = args_mock
+def test_args_version(capsys):
+    with pytest.raises(SystemExit):
+        cli.parse_args(["--version"])
+    assert VERSION == capsys.readouterr().out.strip()
+
 
-    with output_util.captured_output() as (out, err):
+@mock.patch("gitlabber.cli.parse_args")
+def test_main_version(mock_parse_args, capsys):
+    with mock.patch.object(cli.sys, "argv", ["gitlabber", "--version"]):
         with pytest.raises(SystemExit):
             cli.main()
-            assert VERSION == out.getvalue()
+    assert VERSION == capsys.readouterr().out.strip()
+    mock_parse_args.assert_not_called()
 
 
 @mock.patch("gitlabber.cli.logging")
 @mock.patch("gitlabber.cli.sys")
 @mock.patch("gitlabber.cli.os")
 @mock.patch("gitlabber.cli.log")
-@mock.patch("gitlabber.cli.GitlabTree")
-def test_args_logging(mock_tree, mock_log, mock_os, mock_sys, mock_logging):
+@mock.patch("gitlabber.gitlab_tree.GitlabTree")
+def test_args_logging(mock_tree, mock_log, mock_os, mock_sys, mock_logging, monkeypatch):
     args_mock = mock.Mock()
     args_mock.return_value = Node(
-        type="test", name="test", version=None, verbose=True, include="", exclude="", url="test_url", token="test_token", method=CloneMethod.SSH, naming=FolderNaming.PATH, archived=ArchivedResults.INCLUDE, file=None, concurrency=1, recursive=False, disble_progress=True, print=None, dest=".", include_shared=True, use_fetch=None, hide_token=None, user_projects=None, group_search=None, git_options=None)
-    cli.parse_args = args_mock
+        type="test", name="test", verbose=True, include="", exclude="", url="test_url", token="test_token", method=CloneMethod.SSH, naming=FolderNaming.PATH, archived=ArchivedResults.INCLUDE, file=None, concurrency=1, recursive=False, disble_progress=True, print=None, dest=".", include_shared=True, use_fetch=None, hide_token=None, user_projects=None, group_search=None, git_options=None, depth=None, cache_ttl=None, api_concurrency=5, git_trace=False, ssh_multiplex=False, partial_clone=None, min_age=None)
+    monkeypatch.setattr(cli, "parse_args", args_mock)
 
     mock_streamhandler = mock.Mock()
     mock_logging.StreamHandler = mock_streamhandler
@@ -51,30 +58,82 @@ def test_args_logging(mock_tree, mock_log, mock_os, mock_sys, mock_logging):
     mock_formatter.assert_called_once()
 
 
-@mock.patch("gitlabber.cli.GitlabTree")
-def test_args_include(mock_tree):
+@mock.patch("gitlabber.cli.logging")
+@mock.patch("gitlabber.cli.os")
+def test_config_logging_once(mock_os, mock_logging, monkeypatch):
+    monkeypatch.setattr(cli, "logging_state", None)
+    args = Node(name="test", verbose=True, print=False, git_trace=False)
+
+    cli.config_logging(args)
+    cli.config_logging(args)
+
+    mock_logging.StreamHandler.assert_called_once()
+
+
+@mock.patch("gitlabber.cli.logging")
+def test_config_logging_default(mock_logging, monkeypatch):
+    monkeypatch.setattr(cli, "logging_state", None)
+    monkeypatch.setattr(cli, "log_listener", None)
+
+    cli.config_logging(Node(name="test", verbose=None, print=False, git_trace=False))
+
+    mock_logging.basicConfig.assert_called_once_with(level=mock_logging.INFO, format=cli.LOG_FORMAT, force=False)
+    mock_logging.StreamHandler.assert_not_called()
+
+
+def test_config_logging_verbose_to_default(monkeypatch):
+    monkeypatch.setattr(cli, "logging_state", None)
+    monkeypatch.setattr(logging.root, "handlers", [])
+    level = logging.root.level
+    try:
+        cli.config_logging(Node(name="test", verbose=True, print=False, git_trace=False))
+        assert isinstance(logging.root.handlers[0], logging.handlers.QueueHandler)
+
+        cli.config_logging(Node(name="test", verbose=None, print=False, git_trace=False))
+        assert cli.log_listener is None
+        assert logging.INFO == logging.root.level
+        assert not any(isinstance(handler, logging.handlers.QueueHandler) for handler in logging.root.handlers)
+    finally:
+        cli.stop_log_listener()
+        logging.root.setLevel(level)
+
+
+@mock.patch("gitlabber.cli.logging")
+@mock.patch("gitlabber.cli.os")
+def test_config_logging_git_trace(mock_os, mock_logging, monkeypatch):
+    monkeypatch.setattr(cli, "logging_state", None)
+
+    cli.config_logging(Node(name="test", verbose=True, print=False, git_trace=False))
+    mock_os.environ.setdefault.assert_not_called()
+
+    cli.config_logging(Node(name="test", verbose=True, print=False, git_trace=True))
+    mock_os.environ.setdefault.assert_called_once_with("GIT_PYTHON_TRACE", 'full')
+
+
+@mock.patch("gitlabber.gitlab_tree.GitlabTree")
+def test_args_include(mock_tree, monkeypatch):
     inc_groups = "/inc**,/inc**"
     exc_groups = "/exc**,/exc**"
     args_mock = mock.Mock()
     args_mock.return_value = Node(
-        type="test", name="test", version=None, debug=None, include=inc_groups, exclude=exc_groups, url="test_url", token="test_token", method=CloneMethod.SSH, naming=FolderNaming.NAME, archived=ArchivedResults.INCLUDE, file=None, concurrency=1, recursive=False, disble_progress=True, print=None, dest=".", use_fetch=None, hide_token=None, user_projects=None, group_search=None, git_options=None)
-    cli.parse_args = args_mock
+        type="test", name="test", debug=None, include=inc_groups, exclude=exc_groups, url="test_url", token="test_token", method=CloneMethod.SSH, naming=FolderNaming.NAME, archived=ArchivedResults.INCLUDE, file=None, concurrency=1, recursive=False, disble_progress=True, print=None, dest=".", use_fetch=None, hide_token=None, user_projects=None, group_search=None, git_options=None, depth=None, cache_ttl=None, api_concurrency=5, git_trace=False, ssh_multiplex=False, partial_clone=None, min_age=None)
+    monkeypatch.setattr(cli, "parse_args", args_mock)
 
-    split_mock = mock.Mock()
-    cli.split = split_mock
+    parse_patterns_mock = mock.Mock()
+    monkeypatch.setattr(cli, "parse_patterns", parse_patterns_mock)
 
     mock_tree.return_value.is_empty = mock.Mock(return_value=False)
 
     cli.main()
-    split_mock.assert_has_calls([mock.call(inc_groups), mock.call(exc_groups)])
+    parse_patterns_mock.assert_has_calls([mock.call(inc_groups), mock.call(exc_groups)])
 
 
-@mock.patch("gitlabber.cli.GitlabTree")
-def test_args_include(mock_tree):
+@mock.patch("gitlabber.gitlab_tree.GitlabTree")
+def test_args_include(mock_tree, monkeypatch):
     args_mock = mock.Mock()
     args_mock.return_value = Node(
-        type="test", name="test", version=None, verbose=None, include="", exclude="", url="test_url", token="test_token", method=CloneMethod.SSH, naming=FolderNaming.NAME, archived=ArchivedResults.INCLUDE, file=None, concurrency=1, recursive=False, disble_progress=True, print=True, dest=".", print_format=PrintFormat.YAML, include_shared=True, use_fetch=None, hide_token=None, user_projects=None, group_search=None, git_options=None)
-    cli.parse_args = args_mock
+        type="test", name="test", verbose=None, include="", exclude="", url="test_url", token="test_token", method=CloneMethod.SSH, naming=FolderNaming.NAME, archived=ArchivedResults.INCLUDE, file=None, concurrency=1, recursive=False, disble_progress=True, print=True, dest=".", print_format=PrintFormat.YAML, include_shared=True, use_fetch=None, hide_token=None, user_projects=None, group_search=None, git_options=None, depth=None, cache_ttl=None, api_concurrency=5, git_trace=False, ssh_multiplex=False, partial_clone=None, min_age=None)
+    monkeypatch.setattr(cli, "parse_args", args_mock)
 
     print_tree_mock = mock.Mock()
     mock_tree.return_value.print_tree = print_tree_mock
@@ -85,50 +144,91 @@ def test_args_include(mock_tree):
     print_tree_mock.assert_called_once_with(PrintFormat.YAML)
 
 
+def test_args_naming_default():
+    assert FolderNaming.NAME == cli.parse_args(["."]).naming
+    assert FolderNaming.PATH == cli.parse_args(["-n", "path", "."]).naming
+
+
+def test_args_env_defaults_read_per_parse(monkeypatch):
+    monkeypatch.setenv("GITLABBER_GIT_CONCURRENCY", "3")
+    monkeypatch.setenv("GITLAB_URL", "first_url")
+    args = cli.parse_args(["."])
+    assert 3 == args.concurrency
+    assert "first_url" == args.url
+
+    monkeypatch.setenv("GITLABBER_GIT_CONCURRENCY", "5")
+    monkeypatch.delenv("GITLAB_URL")
+    args = cli.parse_args(["."])
+    assert 5 == args.concurrency
+    assert args.url is None
+
+
+def test_validate_positive_int():
+    assert 3 == cli.validate_positive_int("3")
+    with pytest.raises(ArgumentTypeError):
+        cli.validate_positive_int("0")
+
+
+def test_parse_patterns():
+    assert ("/inc**", "/exc**") == cli.parse_patterns("/inc**,/exc**")
+    assert ("/inc**",) == cli.parse_patterns("/inc**,")
+    assert ("/inc**", "/exc**") == cli.parse_patterns(" /inc** , /exc** ")
+    assert ("/inc**",) == cli.parse_patterns(" /inc** ")
+    assert () == cli.parse_patterns("")
+    assert () == cli.parse_patterns(" ")
+
+
+def test_validate_api_concurrency():
+    assert 20 == cli.validate_api_concurrency("20")
+    with pytest.raises(ArgumentTypeError):
+        cli.validate_api_concurrency("21")
+
+
 def test_validate_path():
     assert "/test" == cli.validate_path("/test/")
     assert "/test" == cli.validate_path("/test")
+    assert "/test" == cli.validate_path("/test//")
     assert "/" == cli.validate_path("//")
     assert "." == cli.validate_path("./")
     assert "." == cli.validate_path(".")
 
-@mock.patch("gitlabber.cli.GitlabTree")
-def test__missing_token(mock_tree):
+@mock.patch("gitlabber.gitlab_tree.GitlabTree")
+def test__missing_token(mock_tree, monkeypatch):
     args_mock = mock.Mock()
     args_mock.return_value = Node(
-        type="test", name="test", version=None, verbose=None, include="", exclude="", url="test_url", token=None, print=True, dest=".")
-    cli.parse_args = args_mock
+        type="test", name="test", verbose=None, include="", exclude="", url="test_url", token=None, print=True, dest=".")
+    monkeypatch.setattr(cli, "parse_args", args_mock)
 
     with pytest.raises(SystemExit):
         cli.main()
 
-@mock.patch("gitlabber.cli.GitlabTree")
-def test_missing_url(mock_tree):
+@mock.patch("gitlabber.gitlab_tree.GitlabTree")
+def test_missing_url(mock_tree, monkeypatch):
     args_mock = mock.Mock()
     args_mock.return_value = Node(
-        type="test", name="test", version=None, verbose=None, include="", exclude="", url=None, token="some_token", print=True, dest=".")
-    cli.parse_args = args_mock
+        type="test", name="test", verbose=None, include="", exclude="", url=None, token="some_token", print=True, dest=".")
+    monkeypatch.setattr(cli, "parse_args", args_mock)
 
     with pytest.raises(SystemExit):
         cli.main()
 
-@mock.patch("gitlabber.cli.GitlabTree")
-def test_empty_tree(mock_tree):
+@mock.patch("gitlabber.gitlab_tree.GitlabTree")
+def test_empty_tree(mock_tree, monkeypatch):
     args_mock = mock.Mock()
     args_mock.return_value = Node(
-        type="test", name="test", version=None, verbose=None, include="", exclude="", url="test_url", token="test_token", method=CloneMethod.SSH, naming=FolderNaming.NAME, archived=ArchivedResults.INCLUDE, file=None, concurrency=1, recursive=False, disble_progress=True, print=True, dest=".", include_shared=True, use_fetch=None, hide_token=None, user_projects=None, group_search=None, git_options=None)
-    cli.parse_args = args_mock
+        type="test", name="test", verbose=None, include="", exclude="", url="test_url", token="test_token", method=CloneMethod.SSH, naming=FolderNaming.NAME, archived=ArchivedResults.INCLUDE, file=None, concurrency=1, recursive=False, disble_progress=True, print=True, dest=".", include_shared=True, use_fetch=None, hide_token=None, user_projects=None, group_search=None, git_options=None, depth=None, cache_ttl=None, api_concurrency=5, git_trace=False, ssh_multiplex=False, partial_clone=None, min_age=None)
+    monkeypatch.setattr(cli, "parse_args", args_mock)
 
     with pytest.raises(SystemExit):
         cli.main()
 
 
-@mock.patch("gitlabber.cli.GitlabTree")
-def test_missing_dest(mock_tree, capsys):
+@mock.patch("gitlabber.gitlab_tree.GitlabTree")
+def test_missing_dest(mock_tree, capsys, monkeypatch):
     args_mock = mock.Mock()
     args_mock.return_value = Node(
-        type="test", name="test", version=None, verbose=None, include="", exclude="", url="test_url", token="test_token", method=CloneMethod.SSH, naming=FolderNaming.NAME, archived=ArchivedResults.INCLUDE, file=None, concurrency=1, recursive=False, disble_progress=True, print=False, dest=None, group_search=None, git_options=None)
-    cli.parse_args = args_mock
+        type="test", name="test", verbose=None, include="", exclude="", url="test_url", token="test_token", method=CloneMethod.SSH, naming=FolderNaming.NAME, archived=ArchivedResults.INCLUDE, file=None, concurrency=1, recursive=False, disble_progress=True, print=False, dest=None, group_search=None, git_options=None, depth=None, cache_ttl=None, api_concurrency=5, git_trace=False, ssh_multiplex=False, partial_clone=None, min_age=None)
+    monkeypatch.setattr(cli, "parse_args", args_mock)
     mock_tree.return_value.is_empty = mock.Mock(return_value=False)
 
     with pytest.raises(SystemExit):
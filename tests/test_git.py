@@ -1,16 +1,34 @@
 
 
 from gitlabber import git
-from gitlabber.git import GitAction
+from gitlabber.git import GitAction, create_project_dir
+from git.exc import GitCommandError, InvalidGitRepositoryError, NoSuchPathError
 from unittest import mock
 from anytree import Node
 import pytest
+import time
+import os
+import threading
+import concurrent.futures
 
 DEST="./test_dest"
 GROUP_PATH = "/group"
 SUBGROUP_PATH = "/group/subgroup"
 PROJECT_PATH = "/group/subgroup/project"
 
+@pytest.fixture(autouse=True)
+def mock_create_project_dir():
+    # the project directories already exist unless a test says otherwise, nothing is created on disk
+    with mock.patch('gitlabber.git.create_project_dir', return_value=False) as mock_create:
+        yield mock_create
+
+
+def mock_no_repo(mock_git):
+    mock_git.InvalidGitRepositoryError = InvalidGitRepositoryError
+    mock_git.NoSuchPathError = NoSuchPathError
+    mock_git.Repo.side_effect = NoSuchPathError("dummy_dir")
+
+
 def create_tree():
     root = Node(type="root", name="root")
     group = Node(type="group", name="group", root_path=GROUP_PATH, parent=root)
@@ -23,46 +41,108 @@ def create_tree():
 @mock.patch('gitlabber.git.git')
 @mock.patch('gitlabber.git.clone_or_pull_project')
 @mock.patch('gitlabber.git.progress')
-def test_create_new_user_dir(mock_progress, mock_clone_or_pull_project, mock_git, mock_os):
-    # git.git = mock.MagicMock()
-    
-    mock_os.path.exists.return_value = False
-
+def test_sync_tree_leaves_dirs_to_workers(mock_progress, mock_clone_or_pull_project, mock_git, mock_os):
     root = create_tree()
     git.sync_tree(root,DEST)
     
-    assert 3 == mock_os.path.exists.call_count
-    mock_os.path.exists.assert_has_calls(
-        [mock.call(DEST+GROUP_PATH), mock.call(DEST+SUBGROUP_PATH), mock.call(DEST+PROJECT_PATH)])
-
-    assert 3 == mock_os.makedirs.call_count
-    mock_os.makedirs.assert_has_calls(
-        [mock.call(DEST+GROUP_PATH), mock.call(DEST+SUBGROUP_PATH), mock.call(DEST+PROJECT_PATH)])
+    mock_os.path.exists.assert_not_called()
+    mock_os.makedirs.assert_not_called()
 
     assert 1 == git.clone_or_pull_project.call_count
+    assert DEST+PROJECT_PATH == git.clone_or_pull_project.call_args[0][0].path
 
 
-@mock.patch('gitlabber.git.git')
-def test_is_git_repo_true(mock_git):
-    mock_repo = mock.Mock()
-    mock_git.Repo = mock_repo
-    git.is_git_repo("dummy_dir")
-    assert 1 == mock_git.Repo.call_count
-    mock_git.Repo.assert_called_once_with("dummy_dir")
+def test_create_new_user_dir(tmp_path):
+    path = str(tmp_path / "group" / "subgroup" / "project")
+
+    assert create_project_dir(path)
+    assert os.path.isdir(path)
+    assert not create_project_dir(path)
+
+
+@mock.patch.dict('os.environ', clear=True)
+@mock.patch('gitlabber.git.clone_or_pull_project')
+@mock.patch('gitlabber.git.progress')
+def test_sync_tree_disables_terminal_prompt(mock_progress, mock_clone_or_pull_project):
+    git.sync_tree(create_tree(), DEST)
+    assert {'GIT_TERMINAL_PROMPT': '0'} == mock_clone_or_pull_project.call_args[0][0].env
+    assert {} == dict(os.environ)
+
+
+@mock.patch.dict('os.environ', {'GIT_TERMINAL_PROMPT': '1'}, clear=True)
+@mock.patch('gitlabber.git.clone_or_pull_project')
+@mock.patch('gitlabber.git.progress')
+def test_sync_tree_keeps_terminal_prompt(mock_progress, mock_clone_or_pull_project):
+    git.sync_tree(create_tree(), DEST)
+    assert {} == mock_clone_or_pull_project.call_args[0][0].env
+    assert {'GIT_TERMINAL_PROMPT': '1'} == dict(os.environ)
+
+
+@mock.patch('gitlabber.git.os')
+@mock.patch('gitlabber.git.clone_or_pull_project')
+@mock.patch('gitlabber.git.progress')
+def test_sync_tree_projects_count(mock_progress, mock_clone_or_pull_project, mock_os):
+    git.sync_tree(create_tree(), DEST, projects=5)
+    mock_progress.init_progress.assert_called_once_with(5)
+
+
+@mock.patch('gitlabber.git.os')
+@mock.patch('gitlabber.git.clone_or_pull_project')
+@mock.patch('gitlabber.git.progress')
+def test_sync_tree_shows_progress(mock_progress, mock_clone_or_pull_project, mock_os):
+    mock_clone_or_pull_project.return_value = 'clone'
+    git.sync_tree(create_tree(), DEST)
+    mock_progress.show_progress.assert_called_once_with("project1", 'clone')
+
+
+@mock.patch('gitlabber.git.os')
+@mock.patch('gitlabber.git.clone_or_pull_project')
+@mock.patch('gitlabber.git.progress')
+def test_sync_tree_submits_all_actions(mock_progress, mock_clone_or_pull_project, mock_os):
+    root = create_tree()
+    for i in range(2, 8):
+        Node(type="project", name=f"project{i}", root_path=f"{SUBGROUP_PATH}/project{i}", parent=root.children[0].children[0])
+
+    git.sync_tree(root, DEST, concurrency=2)
 
+    assert 7 == mock_clone_or_pull_project.call_count
 
-def test_is_git_repo_throws():
-    with pytest.raises(git.git.exc.NoSuchPathError):
-        git.is_git_repo("dummy_dir")
 
+@mock.patch('gitlabber.git.os')
+def test_get_git_actions_depth_first(mock_os):
+    root = create_tree()
+    Node(type="project", name="project2", root_path=GROUP_PATH + "/project2", parent=root.children[0])
+    Node(type="group", name="group2", root_path="/group2", parent=root)
+
+    actions = list(git.get_git_actions(root, DEST, False, False, False))
+
+    assert ["project1", "project2", "group2"] == [action.node.name for action in actions]
+    assert [DEST + PROJECT_PATH, DEST + GROUP_PATH + "/project2", DEST + "/group2"] == [action.path for action in actions]
+
+
+def test_is_git_repo_true(tmp_path):
+    (tmp_path / ".git").mkdir()
+    assert git.is_git_repo(str(tmp_path))
+
+
+def test_is_git_repo_mirror(tmp_path):
+    (tmp_path / "HEAD").write_text("ref: refs/heads/main")
+    (tmp_path / "objects").mkdir()
+    assert git.is_git_repo(str(tmp_path))
+
+
+def test_is_git_repo_false(tmp_path):
+    assert not git.is_git_repo(str(tmp_path))
+    assert not git.is_git_repo(str(tmp_path / "dummy_dir"))
+
+@mock.patch('gitlabber.git.is_git_repo', return_value=True)
 @mock.patch('gitlabber.git.git')
-def test_pull_repo(mock_git):
+def test_pull_repo(mock_git, mock_is_git_repo):
     mock_repo = mock.Mock()
     mock_git.Repo = mock_repo
     repo_instance = mock_git.Repo.return_value
-    git.is_git_repo = mock.MagicMock(return_value=True)
 
-    git.clone_or_pull_project(GitAction(Node(type="test", name="test"), "dummy_dir"))
+    assert "pull" == git.clone_or_pull_project(GitAction(Node(type="test", name="test"), "dummy_dir"))
     mock_git.Repo.assert_called_once_with("dummy_dir")
     repo_instance.remotes.origin.pull.assert_called_once()
 
@@ -71,41 +151,62 @@ def test_pull_repo(mock_git):
 def test_clone_repo(mock_git):
     mock_repo = mock.Mock()
     mock_git.Repo = mock_repo
-    git.is_git_repo = mock.MagicMock(return_value=False)
+    mock_no_repo(mock_git)
 
     git.clone_or_pull_project(
         GitAction(Node(type="project", name="dummy_url", url="dummy_url"), "dummy_dir"))
 
-    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", multi_options=[])
+    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", env=None, multi_options=[])
 
 @mock.patch('gitlabber.git.git')
 def test_clone_repo_recursive(mock_git):
     mock_repo = mock.Mock()
     mock_git.Repo = mock_repo
-    git.is_git_repo = mock.MagicMock(return_value=False)
+    mock_no_repo(mock_git)
 
     git.clone_or_pull_project(
         GitAction(Node(type="project", name="dummy_url", url="dummy_url"), "dummy_dir", recursive=True))
 
-    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", multi_options=['--recursive'])
+    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", env=None, multi_options=['--recursive', '--jobs=0'])
 
 @mock.patch('gitlabber.git.git')
-def test_pull_repo_recursive(mock_git):
+def test_clone_repo_depth(mock_git):
+    mock_repo = mock.Mock()
+    mock_git.Repo = mock_repo
+    mock_no_repo(mock_git)
+
+    git.clone_or_pull_project(
+        GitAction(Node(type="project", name="dummy_url", url="dummy_url"), "dummy_dir", depth=1))
+
+    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", env=None, multi_options=['--depth=1'])
+
+@mock.patch('gitlabber.git.is_git_repo', return_value=True)
+@mock.patch('gitlabber.git.git')
+def test_pull_repo_depth(mock_git, mock_is_git_repo):
+    mock_repo = mock.Mock()
+    mock_git.Repo = mock_repo
+    repo_instance = mock_git.Repo.return_value
+
+    git.clone_or_pull_project(GitAction(Node(type="project", name="test"), "dummy_dir", depth=1))
+    repo_instance.remotes.origin.pull.assert_called_once_with(depth=1)
+
+@mock.patch('gitlabber.git.is_git_repo', return_value=True)
+@mock.patch('gitlabber.git.git')
+def test_pull_repo_recursive(mock_git, mock_is_git_repo):
     mock_repo = mock.Mock()
     mock_git.Repo = mock_repo
     repo_instance = mock_git.Repo.return_value
-    git.is_git_repo = mock.MagicMock(return_value=True)
 
     git.clone_or_pull_project(GitAction(Node(type="project", name="test"), "dummy_dir", recursive=True))
     mock_git.Repo.assert_called_once_with("dummy_dir")
     repo_instance.remotes.origin.pull.assert_called_once()
-    repo_instance.submodule_update.assert_called_once_with(recursive=True)
+    repo_instance.git.submodule.assert_called_once_with('update', '--init', '--recursive', '--jobs=0')
 
+@mock.patch('gitlabber.git.is_git_repo', return_value=True)
 @mock.patch('gitlabber.git.git')
-def test_pull_repo_exception(mock_git):
+def test_pull_repo_exception(mock_git, mock_is_git_repo):
     mock_repo = mock.Mock()
     mock_git.Repo = mock_repo
-    git.is_git_repo = mock.MagicMock(return_value=True)
 
     repo_instance = mock_git.Repo.return_value
     repo_instance.remotes.origin.pull.side_effect=Exception('pull test exception')
@@ -120,21 +221,20 @@ def test_pull_repo_exception(mock_git):
 def test_clone_repo_exception(mock_git):
     mock_repo = mock.Mock()
     mock_git.Repo = mock_repo
-    git.is_git_repo = mock.MagicMock(return_value=False)
-    
-    repo_instance = mock_git.Repo.return_value
-    repo_instance.clone_from.side_effect=Exception('clone test exception')
+    mock_no_repo(mock_git)
+
+    mock_git.Repo.clone_from.side_effect=Exception('clone test exception')
 
     git.clone_or_pull_project(
         GitAction(Node(type="project", name="dummy_url", url="dummy_url"), "dummy_dir"))
-    mock_git.Repo.clone_from.assert_called_once_with('dummy_url', 'dummy_dir', multi_options=[])
+    mock_git.Repo.clone_from.assert_called_once_with('dummy_url', 'dummy_dir', env=None, multi_options=[])
     mock_git.Repo.clone_from.assert_called_once()
 
+@mock.patch('gitlabber.git.is_git_repo', return_value=True)
 @mock.patch('gitlabber.git.git')
-def test_pull_repo_interrupt(mock_git):
+def test_pull_repo_interrupt(mock_git, mock_is_git_repo):
     mock_repo = mock.Mock()
     mock_git.Repo = mock_repo
-    git.is_git_repo = mock.MagicMock(return_value=True)
 
     repo_instance = mock_git.Repo.return_value
     repo_instance.remotes.origin.pull.side_effect=KeyboardInterrupt('pull test keyboard interrupt')
@@ -150,35 +250,255 @@ def test_pull_repo_interrupt(mock_git):
 def test_clone_repo_interrupt(mock_git):
     mock_repo = mock.Mock()
     mock_git.Repo = mock_repo
-    git.is_git_repo = mock.MagicMock(return_value=False)
+    mock_no_repo(mock_git)
     mock_git.Repo.clone_from.side_effect=KeyboardInterrupt('clone test keyboard interrupt')
 
     with pytest.raises(SystemExit):
         git.clone_or_pull_project(GitAction(
             Node(type="project", name="dummy_url", url="dummy_url"), "dummy_dir"))
 
-    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", multi_options=[])
+    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", env=None, multi_options=[])
 
 
 @mock.patch('gitlabber.git.git')
 def test_clone_repo_options_many_options(mock_git):
     mock_repo = mock.Mock()
     mock_git.Repo = mock_repo
-    git.is_git_repo = mock.MagicMock(return_value=False)
+    mock_no_repo(mock_git)
 
     git.clone_or_pull_project(
         GitAction(Node(type="project", name="dummy_url", url="dummy_url"), "dummy_dir", git_options="--opt1=1,--opt2=2"))
 
-    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", multi_options=['--opt1=1','--opt2=2'])
+    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", env=None, multi_options=['--opt1=1','--opt2=2'])
     
     
 @mock.patch('gitlabber.git.git')
 def test_clone_repo_options_with_recursive(mock_git):
     mock_repo = mock.Mock()
     mock_git.Repo = mock_repo
-    git.is_git_repo = mock.MagicMock(return_value=False)
+    mock_no_repo(mock_git)
 
     git.clone_or_pull_project(
         GitAction(Node(type="project", name="dummy_url", url="dummy_url"), "dummy_dir", recursive=True, git_options="--opt1=1,--opt2=2"))
 
-    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", multi_options=['--recursive','--opt1=1','--opt2=2'])
\ No newline at end of file
+    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", env=None, multi_options=['--recursive', '--jobs=0', '--opt1=1', '--opt2=2'])
+
+@mock.patch('gitlabber.git.os')
+@mock.patch('gitlabber.git.clone_or_pull_project')
+@mock.patch('gitlabber.git.progress')
+def test_sync_tree_propagates_interrupt(mock_progress, mock_clone_or_pull_project, mock_os):
+    mock_os.path.exists.return_value = True
+    mock_clone_or_pull_project.side_effect = SystemExit(0)
+
+    with pytest.raises(SystemExit):
+        git.sync_tree(create_tree(), DEST)
+
+
+@mock.patch('gitlabber.git.clone_or_pull_project')
+@mock.patch('gitlabber.git.progress')
+def test_sync_tree_interrupt_cancels_pending(mock_progress, mock_clone_or_pull_project):
+    root = create_tree()
+    for i in range(2, 6):
+        Node(type="project", name=f"project{i}", root_path=f"{SUBGROUP_PATH}/project{i}", parent=root.children[0].children[0])
+    release = threading.Event()
+    futures = []
+
+    class RecordingExecutor(concurrent.futures.ThreadPoolExecutor):
+        def submit(self, fn, *args, **kwargs):
+            future = super().submit(fn, *args, **kwargs)
+            futures.append(future)
+            return future
+
+        def shutdown(self, wait=True, *, cancel_futures=False):
+            super().shutdown(wait=wait, cancel_futures=cancel_futures)
+            # the blocked workers are only released once the queued actions are cancelled
+            if cancel_futures:
+                release.set()
+
+    def interrupt_second(action):
+        if action.node.name == "project2":
+            raise SystemExit(0)
+        release.wait()
+
+    mock_clone_or_pull_project.side_effect = interrupt_second
+
+    # two workers with four queued actions: project1 blocks one worker, the other is interrupted
+    # by project2 and can at most block on project3, so project4 is still queued when cancelled
+    with mock.patch('gitlabber.git.concurrent.futures.ThreadPoolExecutor', RecordingExecutor):
+        with pytest.raises(SystemExit):
+            git.sync_tree(root, DEST, concurrency=2)
+
+    assert 4 == len(futures)
+    assert futures[3].cancelled()
+    assert not futures[0].cancelled()
+    assert "project5" not in [call[0][0].node.name for call in mock_clone_or_pull_project.call_args_list]
+
+
+@mock.patch('gitlabber.git.os')
+@mock.patch('gitlabber.git.clone_or_pull_project')
+@mock.patch('gitlabber.git.progress')
+def test_sync_tree_continues_after_error(mock_progress, mock_clone_or_pull_project, mock_os):
+    root = create_tree()
+    for name in ["project2", "project3"]:
+        Node(type="project", name=name, root_path=SUBGROUP_PATH + "/" + name, parent=root.children[0].children[0])
+
+    def fail_first(action):
+        if action.node.name == "project1":
+            raise PermissionError("dummy_dir")
+        return 'clone'
+    mock_clone_or_pull_project.side_effect = fail_first
+
+    git.sync_tree(root, DEST, concurrency=1)
+    assert 3 == mock_clone_or_pull_project.call_count
+    mock_progress.show_progress.assert_any_call("project1", 'error')
+    assert 3 == mock_progress.show_progress.call_count
+
+
+def test_get_clone_options_cached():
+    git.get_clone_options.cache_clear()
+    options = git.get_clone_options(True, False, 1, "--opt1=1,--opt2=2")
+    assert ('--recursive', '--jobs=0', '--depth=1', '--opt1=1', '--opt2=2') == options
+    assert options is git.get_clone_options(True, False, 1, "--opt1=1,--opt2=2")
+
+
+@mock.patch('gitlabber.git.time')
+@mock.patch('gitlabber.git.git')
+def test_clone_repo_retries_transient_error(mock_git, mock_time):
+    mock_no_repo(mock_git)
+    mock_git.Repo.clone_from.side_effect = [
+        GitCommandError("clone", 128, stderr="fatal: unable to access: Could not resolve host: gitlab.com"), None]
+
+    git.clone_or_pull_project(
+        GitAction(Node(type="project", name="dummy_url", url="dummy_url"), "dummy_dir"))
+
+    assert 2 == mock_git.Repo.clone_from.call_count
+    mock_time.sleep.assert_called_once()
+
+
+@mock.patch('gitlabber.git.time')
+@mock.patch('gitlabber.git.git')
+def test_clone_repo_no_retry_on_error(mock_git, mock_time):
+    mock_no_repo(mock_git)
+    mock_git.Repo.clone_from.side_effect = GitCommandError("clone", 128, stderr="fatal: Authentication failed")
+
+    git.clone_or_pull_project(
+        GitAction(Node(type="project", name="dummy_url", url="dummy_url"), "dummy_dir"))
+
+    mock_git.Repo.clone_from.assert_called_once()
+    mock_time.sleep.assert_not_called()
+
+
+@mock.patch('gitlabber.git.is_git_repo')
+@mock.patch('gitlabber.git.git')
+def test_clone_new_dir_skips_repo_check(mock_git, mock_is_git_repo, mock_create_project_dir):
+    mock_create_project_dir.return_value = True
+    git.clone_or_pull_project(
+        GitAction(Node(type="project", name="dummy_url", url="dummy_url"), "dummy_dir"))
+
+    mock_create_project_dir.assert_called_once_with("dummy_dir")
+
+    mock_is_git_repo.assert_not_called()
+    mock_git.Repo.assert_not_called()
+    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", env=None, multi_options=[])
+
+
+@mock.patch.dict('os.environ', clear=True)
+def test_ssh_multiplexing():
+    with git.ssh_multiplexing(True) as env:
+        ssh_command = env['GIT_SSH_COMMAND']
+        assert 'ControlMaster=auto' in ssh_command
+        assert 'ControlPersist' in ssh_command
+        assert 'GIT_SSH_COMMAND' not in os.environ
+
+
+@mock.patch.dict('os.environ', {'GIT_SSH_COMMAND': 'ssh -i key'}, clear=True)
+def test_ssh_multiplexing_keeps_ssh_command():
+    with git.ssh_multiplexing(True) as env:
+        assert env is None
+        assert 'ssh -i key' == os.environ['GIT_SSH_COMMAND']
+    assert 'ssh -i key' == os.environ['GIT_SSH_COMMAND']
+
+
+@mock.patch.dict('os.environ', clear=True)
+def test_ssh_multiplexing_disabled():
+    with git.ssh_multiplexing(False) as env:
+        assert env is None
+        assert 'GIT_SSH_COMMAND' not in os.environ
+
+
+@mock.patch('gitlabber.git.is_git_repo', return_value=True)
+@mock.patch('gitlabber.git.git')
+def test_pull_repo_ssh_env(mock_git, mock_is_git_repo):
+    repo_instance = mock_git.Repo.return_value
+    git.clone_or_pull_project(GitAction(Node(type="project", name="test"), "dummy_dir", env={'GIT_SSH_COMMAND': 'ssh'}))
+
+    repo_instance.git.update_environment.assert_called_once_with(GIT_SSH_COMMAND='ssh')
+    repo_instance.remotes.origin.pull.assert_called_once()
+
+
+@mock.patch('gitlabber.git.git')
+def test_clone_repo_ssh_env(mock_git):
+    mock_no_repo(mock_git)
+    git.clone_or_pull_project(
+        GitAction(Node(type="project", name="dummy_url", url="dummy_url"), "dummy_dir", env={'GIT_SSH_COMMAND': 'ssh'}))
+
+    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", env={'GIT_SSH_COMMAND': 'ssh'}, multi_options=[])
+
+
+@mock.patch('gitlabber.git.git')
+def test_clone_repo_partial(mock_git):
+    mock_no_repo(mock_git)
+    git.clone_or_pull_project(
+        GitAction(Node(type="project", name="dummy_url", url="dummy_url"), "dummy_dir", partial_clone="blob:none"))
+
+    mock_git.Repo.clone_from.assert_called_once_with("dummy_url", "dummy_dir", env=None, multi_options=['--filter=blob:none'])
+
+
+@mock.patch('gitlabber.git.fetched_within', return_value=True)
+@mock.patch('gitlabber.git.git')
+def test_pull_repo_skips_recently_fetched(mock_git, mock_fetched_within):
+    assert 'skip' == git.clone_or_pull_project(GitAction(Node(type="project", name="test"), "dummy_dir", min_age=300))
+
+    mock_fetched_within.assert_called_once_with("dummy_dir", 300)
+    mock_git.Repo.assert_not_called()
+
+
+def test_fetched_within(tmp_path):
+    (tmp_path / ".git").mkdir()
+    fetch_head = tmp_path / ".git" / "FETCH_HEAD"
+    fetch_head.touch()
+
+    assert git.fetched_within(str(tmp_path), 300)
+    os.utime(fetch_head, (time.time() - 600, time.time() - 600))
+    assert not git.fetched_within(str(tmp_path), 300)
+    assert not git.fetched_within(str(tmp_path / "missing"), 300)
+
+
+def test_fetched_within_fresh_clone(tmp_path):
+    (tmp_path / ".git").mkdir()
+    head = tmp_path / ".git" / "HEAD"
+    head.touch()
+
+    assert git.fetched_within(str(tmp_path), 300)
+    os.utime(head, (time.time() - 600, time.time() - 600))
+    assert not git.fetched_within(str(tmp_path), 300)
+
+
+def test_fetched_within_fresh_mirror(tmp_path):
+    (tmp_path / "HEAD").touch()
+    assert git.fetched_within(str(tmp_path), 300)
+
+
+@mock.patch('gitlabber.git.git')
+def test_clone_then_min_age_skips(mock_git, tmp_path):
+    mock_no_repo(mock_git)
+
+    def clone(url, path, **kwargs):
+        os.makedirs(os.path.join(path, '.git'))
+        open(os.path.join(path, '.git', 'HEAD'), 'w').close()
+    mock_git.Repo.clone_from.side_effect = clone
+    path = str(tmp_path / "project")
+
+    assert 'clone' == git.clone_or_pull_project(GitAction(Node(type="project", name="project", url="dummy_url"), path))
+    assert 'skip' == git.clone_or_pull_project(GitAction(Node(type="project", name="project", url="dummy_url"), path, min_age=300))
+    mock_git.Repo.clone_from.assert_called_once()
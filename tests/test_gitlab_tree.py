@@ -1,4 +1,6 @@
-
+import os
+import pytest
+from unittest import mock
 from gitlabber.method import CloneMethod
 import tests.gitlab_test_utils as gitlab_util
 import tests.io_test_util as output_util
@@ -11,6 +13,40 @@ def test_load_tree(monkeypatch):
     gitlab_util.validate_tree(gl.root)
 
 
+def test_load_tree_paginated(monkeypatch):
+    from gitlabber import gitlab_tree
+    monkeypatch.setattr(gitlab_tree, "PAGE_SIZE", 2)
+    gl = gitlab_util.create_test_gitlab_with_many_projects(monkeypatch, 5)
+    gl.load_tree()
+    assert [child.name for child in gl.root.children[0].children] == [f"project{i}" for i in range(5)]
+
+
+def test_load_tree_nested_subgroups(monkeypatch):
+    gl = gitlab_util.create_test_gitlab_with_nested_subgroups(monkeypatch)
+    gl.load_tree()
+    group = gl.root.children[0]
+    assert [child.name for child in group.children] == ["subgroup", "sibling"]
+    assert group.children[0].children[0].root_path == "/group/subgroup/nested"
+    assert group.children[0].children[0].children[0].name == "project"
+    assert group.children[1].is_leaf is True
+
+
+def test_add_descendant_groups_skips_orphans(monkeypatch):
+    from anytree import Node
+    gl = gitlab_util.create_test_gitlab_with_nested_subgroups(monkeypatch)
+    gl.progress = mock.Mock()
+    group = gl.gitlab.groups.get(31)
+    orphan = gitlab_util.MockNode("subgroup", 35, "orphan", gitlab_util.SUBGROUP_URL + "/orphan", parent_id=999)
+    node = Node("group", parent=gl.root, root_path="/group")
+
+    added = gl.add_descendant_groups(group, node, list(group.descendant_groups.nodes) + [orphan])
+
+    assert 4 == len(added)
+    assert "orphan" not in [added_node.name for _, added_node in added]
+    gl.progress.update_progress_length.assert_called_once_with(3)
+    assert 3 == gl.progress.show_progress.call_count
+
+
 def test_filter_tree_include_positive(monkeypatch):
     gl = gitlab_util.create_test_gitlab(monkeypatch, includes=["/group**"])
     gl.load_tree()
@@ -143,6 +179,14 @@ def test_get_ca_path(monkeypatch):
     result = gitlab_tree.GitlabTree.get_ca_path()
     assert result == True
 
+
+def test_get_session():
+    from gitlabber import gitlab_tree
+    session = gitlab_tree.GitlabTree.get_session(11)
+    adapter = session.get_adapter("https://gitlab.com")
+    assert adapter._pool_maxsize == 11
+    assert adapter.max_retries.total == 3
+
 def test_shared_included(monkeypatch):
     gl = gitlab_util.create_test_gitlab_with_shared(monkeypatch, with_shared=True)
 
@@ -173,3 +217,48 @@ def test_hide_token_from_project_url(monkeypatch):
     gl.load_tree()
     gl.print_tree()
     assert 'gitlab-token:xxx@' not in gl.root.children[0].children[0].children[0].url
+
+
+def test_load_tree_from_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    gl = gitlab_util.create_test_gitlab(monkeypatch, cache_ttl=60)
+    gl.load_tree()
+    assert os.path.exists(gl.cache_file)
+
+    cached = gitlab_util.create_test_gitlab(monkeypatch, cache_ttl=60)
+    monkeypatch.setattr(cached.gitlab, "groups", gitlab_util.Tree(gitlab_util.Listable()))
+    cached.load_tree()
+    gitlab_util.validate_tree(cached.root)
+
+
+def test_load_tree_listing_error_not_cached(monkeypatch, tmp_path):
+    from gitlab.exceptions import GitlabListError
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    gl = gitlab_util.create_test_gitlab(monkeypatch, cache_ttl=60)
+    subgroup = gl.gitlab.groups.get(3)
+    monkeypatch.setattr(subgroup, "projects", mock.Mock(**{"list.side_effect": GitlabListError("forbidden", 403)}))
+    gl.load_tree()
+    assert gl.root.children[0].children[0].is_leaf is True
+    assert not os.path.exists(gl.cache_file)
+
+
+def test_save_cached_tree_failure_removes_temp_file(monkeypatch, tmp_path):
+    from gitlabber import gitlab_tree
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    gl = gitlab_util.create_test_gitlab(monkeypatch, cache_ttl=60)
+    monkeypatch.setattr(gitlab_tree.JsonExporter, "write", mock.Mock(side_effect=KeyboardInterrupt))
+    with pytest.raises(KeyboardInterrupt):
+        gl.load_tree()
+    assert [] == os.listdir(os.path.dirname(gl.cache_file))
+
+
+def test_load_tree_expired_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    gl = gitlab_util.create_test_gitlab(monkeypatch, cache_ttl=60)
+    gl.load_tree()
+    os.utime(gl.cache_file, (0, 0))
+
+    expired = gitlab_util.create_test_gitlab(monkeypatch, cache_ttl=60)
+    monkeypatch.setattr(expired.gitlab, "groups", gitlab_util.Tree(gitlab_util.Listable()))
+    expired.load_tree()
+    assert expired.is_empty() is True